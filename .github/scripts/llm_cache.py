@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import shelve
+import threading
+import time
+
+# Responses are only reused for temperature=0 requests, which are
+# deterministic enough to replay across scheduled runs
+CACHE_PATH = '.cache/llm'
+EXPIRE_SECONDS = 7 * 86400
+
+# shelve is not safe for concurrent access
+_lock = threading.Lock()
+
+def cache_key(request):
+    """Hash the parts of a request that determine its response"""
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _get(key):
+    with _lock, shelve.open(CACHE_PATH) as cache:
+        entry = cache.get(key)
+    if entry and time.time() - entry['time'] < EXPIRE_SECONDS:
+        return entry['value']
+    return None
+
+def prune():
+    """Delete expired entries so the cache doesn't grow without bound"""
+    if not os.path.isdir(os.path.dirname(CACHE_PATH)):
+        return
+    now = time.time()
+    with _lock, shelve.open(CACHE_PATH) as cache:
+        for key in [k for k, entry in cache.items() if now - entry['time'] >= EXPIRE_SECONDS]:
+            del cache[key]
+
+def _set(key, value):
+    with _lock, shelve.open(CACHE_PATH) as cache:
+        cache[key] = {'time': time.time(), 'value': value}
+
+def chat_completion(client, parse=lambda content: content, **request):
+    """Return parse() of a chat completion's message content, cached on disk
+
+    A reply is only stored once parse() accepted it; if it raises, the
+    error propagates and the request is sent again next time instead of
+    replaying the bad reply."""
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    key = cache_key(request)
+
+    content = _get(key)
+    if content is not None:
+        return parse(content)
+
+    response = client.chat.completions.create(**request)
+    content = (response.choices[0].message.content or '').strip()
+    result = parse(content)
+    _set(key, content)
+    return result
+
+def embed(client, texts, model="text-embedding-3-small"):
+    """Return an embedding per text, requesting only the ones not cached yet"""
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    keys = [cache_key({'model': model, 'input': text}) for text in texts]
+    vectors = [_get(key) for key in keys]
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        response = client.embeddings.create(
+            model=model,
+            input=[texts[i] for i in missing]
+        )
+        for i, item in zip(missing, response.data):
+            vectors[i] = item.embedding
+            _set(keys[i], item.embedding)
+
+    return vectors
@@ -1,138 +1,276 @@
 import json
+import ahocorasick
 import feedparser
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree, html
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
 from datetime import datetime
 import os
 from openai import OpenAI
+import llm_cache
+from llm_cache import chat_completion, embed
+import numpy as np
+import orjson
+import tiktoken
 import base64
+import calendar
 import difflib
+import functools
+import time
+
+# Keywords that mark a feed entry as a potential incident (lowercase)
+KEYWORDS = (
+    'magdeburg',
+    'rassistisch',
+    'fremdenfeindlich',
+    'ausländerfeindlich',
+    'hassverbrechen',
+    'übergriff',
+    'angriff migranten',
+    'rassismus'
+)
 
 # News sources to monitor
 SOURCES = [
     {
         'name': 'MDR Sachsen-Anhalt',
-        'feed': 'https://www.mdr.de/nachrichten/index-rss.xml',
-        'keywords': [
-            'magdeburg', 
-            'rassistisch', 
-            'fremdenfeindlich',
-            'ausländerfeindlich',
-            'hassverbrechen',
-            'übergriff',
-            'angriff migranten',
-            'rassismus'
-        ]
+        'feed': 'https://www.mdr.de/nachrichten/index-rss.xml'
     },
     {
         'name': 'taz',
-        'feed': 'https://taz.de/!p4608;rss/',
-        'keywords': [
-            'magdeburg',
-            'rassistisch',
-            'fremdenfeindlich',
-            'ausländerfeindlich',
-            'hassverbrechen',
-            'übergriff',
-            'angriff migranten',
-            'rassismus'
-        ]
+        'feed': 'https://taz.de/!p4608;rss/'
     },
     {
         'name': 'sz',
-        'feed': 'https://rss.sueddeutsche.de/alles',
-        'keywords': [
-            'magdeburg',
-            'rassistisch',
-            'fremdenfeindlich',
-            'ausländerfeindlich',
-            'hassverbrechen',
-            'übergriff',
-            'angriff migranten',
-            'rassismus'
-        ]
+        'feed': 'https://rss.sueddeutsche.de/alles'
     },
     {
         'name': 'Mobile Opferberatung',
-        'feed': 'https://www.mobile-opferberatung.de/monitoring/chronik-2024',
-        'keywords': [
-            'magdeburg',
-            'rassistisch',
-            'fremdenfeindlich',
-            'ausländerfeindlich',
-            'hassverbrechen',
-            'übergriff',
-            'angriff migranten',
-            'rassismus'
-        ]
+        'feed': 'https://www.mobile-opferberatung.de/monitoring/chronik-2024'
     },
     {
         'name': 'Landesportal Sachsen-Anhalt - Pressemitteilungen der Polizei',
-        'feed': 'https://www.sachsen-anhalt.de/bs/pressemitteilungen/rss-feeds?tx_tsarssinclude_rss%5Baction%5D=feed&tx_tsarssinclude_rss%5Bcontroller%5D=Rss&tx_tsarssinclude_rss%5Buid%5D=75&type=9988&cHash=6052a14b7487702c9e9ca69eac34418a',
-        'keywords': [
-            'magdeburg',
-            'rassistisch',
-            'fremdenfeindlich',
-            'ausländerfeindlich',
-            'hassverbrechen',
-            'übergriff',
-            'angriff migranten',
-            'rassismus'
-        ]
+        'feed': 'https://www.sachsen-anhalt.de/bs/pressemitteilungen/rss-feeds?tx_tsarssinclude_rss%5Baction%5D=feed&tx_tsarssinclude_rss%5Bcontroller%5D=Rss&tx_tsarssinclude_rss%5Buid%5D=75&type=9988&cHash=6052a14b7487702c9e9ca69eac34418a'
     }
 ]
 
+def build_keyword_automaton(keywords):
+    """Compile keywords into an Aho-Corasick automaton that finds all of them in one pass"""
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AUTOMATON = build_keyword_automaton(KEYWORDS)
+
+# Feeds and article pages are fetched concurrently; this caps the number of
+# requests in flight and stays below the connection pool size so threads
+# don't queue for sockets
+MAX_WORKERS = 8
+
+# Concurrent OpenAI requests when parsing articles; kept separate from the
+# download pool so slow LLM calls never hold up article fetches
+LLM_WORKERS = 10
+
+# Validators for conditional feed requests and the newest entry date per
+# feed, kept between runs next to the LLM cache
+FEED_CACHE_PATH = '.cache/feed_cache.json'
+
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
+# Shared session for every HTTP request: concurrent fetches reuse
+# keep-alive connections, and rate limits or server errors are retried with
+# backoff. Only GET is retried here: every GitHub call is a GraphQL POST,
+# and the PR mutation may already have gone through when a 502/503 comes
+# back, so resending it would fail on the existing branch. The read-only
+# repository query is retried explicitly in create_pull_request instead.
+# After the last retry the response is returned as-is so callers keep
+# handling status codes themselves
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+session = requests.Session()
+adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        raise_on_status=False
+    )
+)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+# Articles are cut to this many tokens before they are sent to the LLM; the
+# relevant facts are near the top and long features only add cost
+MAX_ARTICLE_TOKENS = 2000
+
+@functools.cache
+def _encoder():
+    # Built on first use: tiktoken downloads its BPE file, which must not
+    # happen on import (tests, offline runs)
+    return tiktoken.encoding_for_model("gpt-4o-mini")
+
+# Cosine similarity bands for duplicate detection: below DISTINCT the
+# incidents are clearly different, above DUPLICATE clearly the same; only
+# the band in between is left to GPT-4
+DISTINCT_SIMILARITY = 0.6
+DUPLICATE_SIMILARITY = 0.92
+
+# Article pages are served as UTF-8; don't rely on libxml2's Latin-1 default
+HTML_PARSER = html.HTMLParser(encoding='utf-8')
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# MDR: first matching container wins, same order as the old CSS selectors
+MDR_ARTICLE = [
+    etree.XPath(f"//*[{_has_class('content')}]//article"),
+    etree.XPath("//main//article"),
+    etree.XPath(f"//*[{_has_class('mdr-page__content')}]"),
+]
+MDR_TEXT = etree.XPath(".//p | .//h1 | .//h2 | .//h3")
+
+TAZ_ARTICLE = etree.XPath(f"//article[{_has_class('article')}]")
+TAZ_TEXT = etree.XPath(f".//p[not({_has_class('article__meta')})] | .//h1 | .//h2")
+
 def load_current_incidents():
-    with open('data/incidents.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open('data/incidents.json', 'rb') as f:
+        return orjson.loads(f.read())
+
+def build_incident_indexes(incidents):
+    """Index recorded incidents by source URL and by date"""
+    url_to_incident = {}
+    date_index = defaultdict(list)
+    for incident in incidents:
+        date_index[incident['date']].append(incident)
+        for source in incident['sources']:
+            url_to_incident[source['url']] = incident
+    return url_to_incident, date_index
+
+def load_feed_cache():
+    """Load the HTTP validators and newest entry date of each feed from the last run"""
+    try:
+        with open(FEED_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_feed_cache(feed_cache):
+    os.makedirs(os.path.dirname(FEED_CACHE_PATH), exist_ok=True)
+    with open(FEED_CACHE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(feed_cache, f, indent=2)
 
 def extract_text_from_article(url):
-    """Extract main article text from URL"""
+    """Extract main article text from URL, None if the page has no known article layout"""
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
         'Accept-Language': 'de,en-US;q=0.7,en;q=0.3'
     }
     
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
+    # Transient errors propagate so the caller can retry the article next run,
+    # permanent ones (gone, forbidden, empty page) would fail the same way again
+    response = session.get(url, headers=headers, timeout=30)
+    if response.status_code == 429 or response.status_code >= 500:
         response.raise_for_status()
-        response.encoding = 'utf-8'
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # MDR specific extraction
-        if 'mdr.de' in url:
-            # Try different possible article containers
-            article = (
-                soup.select_one('.content article') or 
-                soup.select_one('main article') or
-                soup.select_one('.mdr-page__content')
-            )
-            
-            if article:
-                # Get text from paragraphs and headlines
-                text_elements = article.select('p, h1, h2, h3')
-                return ' '.join(elem.get_text(strip=True) for elem in text_elements)
-        
-        # taz specific extraction
-        if 'taz.de' in url:
-            article = soup.select_one('article.article')
-            if article:
-                text_elements = article.select('p:not(.article__meta), h1, h2')
-                return ' '.join(elem.get_text(strip=True) for elem in text_elements)
-        
-        print(f"Could not find article content in {url}")
+    if not response.ok:
+        print(f"Skipping {url}: HTTP {response.status_code}")
         return None
+
+    try:
+        tree = html.fromstring(response.content, parser=HTML_PARSER)
+    except etree.ParserError as e:
+        print(f"Could not parse {url}: {str(e)}")
+        return None
+    
+    # MDR specific extraction
+    if 'mdr.de' in url:
+        # Try different possible article containers
+        article = next(
+            (found[0] for xpath in MDR_ARTICLE if (found := xpath(tree))),
+            None
+        )
         
+        if article is not None:
+            # Get text from paragraphs and headlines
+            text_elements = MDR_TEXT(article)
+            return ' '.join(elem.text_content().strip() for elem in text_elements)
+    
+    # taz specific extraction
+    if 'taz.de' in url:
+        found = TAZ_ARTICLE(tree)
+        if found:
+            text_elements = TAZ_TEXT(found[0])
+            return ' '.join(elem.text_content().strip() for elem in text_elements)
+    
+    print(f"Could not find article content in {url}")
+    return None
+
+def fetch_feed(source, validators):
+    """Fetch and parse the RSS feed of a source, skipping the body if it is unchanged"""
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('modified'):
+        headers['If-Modified-Since'] = validators['modified']
+
+    try:
+        with session.get(source['feed'], headers=headers, timeout=30, stream=True) as response:
+            if response.status_code == 304:
+                feed = feedparser.FeedParserDict(entries=[], bozo=False)
+            else:
+                # Let feedparser read the (decompressed) body straight from
+                # the socket instead of buffering it in the response first;
+                # it detects the encoding from the XML declaration
+                response.raw.decode_content = True
+                feed = feedparser.parse(response.raw)
+
+            # Same fields feedparser sets when it does the request itself
+            feed['status'] = response.status_code
+            feed['etag'] = response.headers.get('ETag')
+            feed['modified'] = response.headers.get('Last-Modified')
+            return feed
     except Exception as e:
-        print(f"Error extracting text from {url}: {str(e)}")
+        print(f"Error fetching feed {source['feed']}: {str(e)}")
         return None
 
+# Structured output for parse_with_llm; strict mode requires every field,
+# so non-incidents are signalled with is_incident instead of "null"
+INCIDENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_incident": {"type": "boolean"},
+        "date": {"type": "string"},
+        "location": {"type": "string"},
+        "description": {"type": "string"},
+        "type": {"enum": ["physical_attack", "verbal_attack", "property_damage", "other"]},
+        "status": {"type": "string"}
+    },
+    "required": ["is_incident", "date", "location", "description", "type", "status"],
+    "additionalProperties": False
+}
+
+def parse_incident_reply(content):
+    """Decode a parse_with_llm reply, rejecting anything that doesn't match INCIDENT_SCHEMA"""
+    incident = json.loads(content)
+    if (not isinstance(incident, dict)
+            or any(key not in incident for key in INCIDENT_SCHEMA['required'])
+            or not isinstance(incident['is_incident'], bool)):
+        raise ValueError(f"Reply does not match the incident schema: {content[:200]}")
+    return incident
+
 def parse_with_llm(article_text, url, source_name):
     """Use OpenAI to parse article text into structured incident data"""
+    encoder = _encoder()
+    tokens = encoder.encode(article_text)
+    if len(tokens) > MAX_ARTICLE_TOKENS:
+        article_text = encoder.decode(tokens[:MAX_ARTICLE_TOKENS])
     
     prompt = f"""Analysiere diesen Artikel streng nach folgenden Kriterien für rassistisch motivierte Vorfälle in Magdeburg.
 
@@ -143,7 +281,7 @@ def parse_with_llm(article_text, url, source_name):
     4. Der Vorfall ist durch offizielle Quellen (Polizei, Behörden) oder mehrere unabhängige Zeugen bestätigt
     5. Es gibt eine klare rassistische oder fremdenfeindliche Motivation (z.B. durch Äußerungen oder Kontext)
 
-    Antworte mit "null" wenn:
+    Setze is_incident auf false wenn:
     - Auch nur EINES der obigen Kriterien nicht eindeutig erfüllt ist
     - Der Artikel nur allgemein über Rassismus berichtet
     - Der Artikel sich auf frühere Vorfälle bezieht
@@ -151,11 +289,10 @@ def parse_with_llm(article_text, url, source_name):
     - Der Vorfall nicht in Magdeburg stattfand
     - Der Vorfall nicht ausreichend verifiziert ist
 
-    Falls ALLE Kriterien erfüllt sind, formatiere den Vorfall als JSON mit:
+    Falls ALLE Kriterien erfüllt sind, setze is_incident auf true und beschreibe den Vorfall mit:
     - date (YYYY-MM-DD)
     - location (präziser Ort in Magdeburg)
     - description (kurze faktische Beschreibung mit Nennung der Quelle der Verifizierung)
-    - sources (Array mit url und name)
     - type (physical_attack, verbal_attack, property_damage, oder other)
     - status (verified wenn von Polizei/Behörden bestätigt)
 
@@ -163,8 +300,10 @@ def parse_with_llm(article_text, url, source_name):
     {article_text}
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4-turbo-preview",
+    incident = chat_completion(
+        client,
+        parse=parse_incident_reply,
+        model="gpt-4o-mini",
         messages=[{
             "role": "system",
             "content": "Du bist ein sehr kritischer Fact-Checker. Gib nur Vorfälle zurück, die zu 100% verifiziert und relevant sind."
@@ -172,157 +311,271 @@ def parse_with_llm(article_text, url, source_name):
             "role": "user",
             "content": prompt
         }],
-        temperature=0
+        temperature=0,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "incident", "strict": True, "schema": INCIDENT_SCHEMA}
+        }
     )
 
-    try:
-        result = response.choices[0].message.content.strip()
-        if result.lower() == "null":
-            return None
-            
-        incident = json.loads(result)
-        # Add source if not already included
-        if not any(s['url'] == url for s in incident.get('sources', [])):
-            incident.setdefault('sources', []).append({
-                'url': url,
-                'name': source_name
-            })
-        return incident
-    except Exception as e:
-        print(f"Failed to parse incident from {url}: {str(e)}")
+    if not incident.pop('is_incident'):
         return None
 
-def create_pull_request(new_incidents):
-    """Create a PR with new incidents"""
+    incident['sources'] = [{
+        'url': url,
+        'name': source_name
+    }]
+    return incident
+
+REPOSITORY_QUERY = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    id
+    ref(qualifiedName: "refs/heads/main") {
+      target { oid }
+    }
+  }
+}
+"""
+
+# Mutation fields run in order, so the branch exists before the commit
+# lands on it and the commit exists before the PR is opened
+CREATE_PULL_REQUEST_MUTATION = """
+mutation(
+  $repositoryId: ID!, $repository: String!, $branchName: String!,
+  $branchRef: String!, $headOid: GitObjectID!, $title: String!,
+  $body: String!, $contents: Base64String!
+) {
+  createRef(input: {repositoryId: $repositoryId, name: $branchRef, oid: $headOid}) {
+    ref { name }
+  }
+  createCommitOnBranch(input: {
+    branch: {repositoryNameWithOwner: $repository, branchName: $branchName},
+    message: {headline: $title},
+    expectedHeadOid: $headOid,
+    fileChanges: {additions: [{path: "data/incidents.json", contents: $contents}]}
+  }) {
+    commit { oid }
+  }
+  createPullRequest(input: {
+    repositoryId: $repositoryId, baseRefName: "main", headRefName: $branchName,
+    title: $title, body: $body
+  }) {
+    pullRequest { url }
+  }
+}
+"""
+
+def create_pull_request(current_data, new_incidents, updated_incidents=()):
+    """Create a PR with new incidents and added sources, returning whether it was opened"""
     repo = os.environ.get("GITHUB_REPOSITORY")
     token = os.environ.get("GITHUB_TOKEN")
     
     if not repo or not token:
         print("Missing repository information or token")
-        return
+        return False
 
     headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
+        "Authorization": f"bearer {token}"
     }
-    api_base = "https://api.github.com"
+    graphql_url = "https://api.github.com/graphql"
 
-    # Create a new branch
-    branch_name = f"update-incidents-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-    
-    # Get the current main branch SHA
-    r = requests.get(f"{api_base}/repos/{repo}/git/ref/heads/main", headers=headers)
-    if r.status_code != 200:
+    # Get the repository id and the current main branch SHA
+    owner, name = repo.split("/", 1)
+    for attempt in range(4):
+        if attempt:
+            time.sleep(0.5 * 2 ** attempt)
+        r = session.post(
+            graphql_url,
+            headers=headers,
+            json={"query": REPOSITORY_QUERY, "variables": {"owner": owner, "name": name}}
+        )
+        if r.status_code not in RETRY_STATUSES:
+            break
+    if r.status_code != 200 or r.json().get("errors"):
         print("Failed to get main branch reference")
-        return
-    main_sha = r.json()["object"]["sha"]
+        return False
+    repository = r.json()["data"]["repository"]
 
-    # Create new branch
-    data = {
-        "ref": f"refs/heads/{branch_name}",
-        "sha": main_sha
-    }
-    r = requests.post(f"{api_base}/repos/{repo}/git/refs", headers=headers, json=data)
-    if r.status_code != 201:
-        print("Failed to create branch")
-        return
+    # Create the branch, commit the file and open the PR in one request
+    branch_name = f"update-incidents-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
 
-    # Update file in new branch
-    with open('data/incidents.json', 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    data = {
-        "message": f"Add {len(new_incidents)} new incidents",
-        "content": base64.b64encode(content.encode()).decode(),
-        "branch": branch_name
+    # Same layout as the checked-in file: two-space indent, raw UTF-8
+    content = orjson.dumps(current_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    variables = {
+        "repositoryId": repository["id"],
+        "repository": repo,
+        "branchName": branch_name,
+        "branchRef": f"refs/heads/{branch_name}",
+        "headOid": repository["ref"]["target"]["oid"],
+        "title": pull_request_title(new_incidents, updated_incidents),
+        "body": "Automatically detected new incidents from news sources.",
+        "contents": base64.b64encode(content).decode()
     }
-    
-    r = requests.put(
-        f"{api_base}/repos/{repo}/contents/data/incidents.json",
+    r = session.post(
+        graphql_url,
         headers=headers,
-        json=data
+        json={"query": CREATE_PULL_REQUEST_MUTATION, "variables": variables}
     )
+    if r.status_code != 200 or r.json().get("errors"):
+        print(f"Failed to create PR: {r.text}")
+        return False
     
-    if r.status_code != 200:
-        print("Failed to update file")
-        return
+    print(f"Created PR: {r.json()['data']['createPullRequest']['pullRequest']['url']}")
+    return True
 
-    # Create PR
-    pr_data = {
-        "title": f"Add {len(new_incidents)} new incidents",
-        "body": "Automatically detected new incidents from news sources.",
-        "head": branch_name,
-        "base": "main"
-    }
-    
-    r = requests.post(f"{api_base}/repos/{repo}/pulls", headers=headers, json=pr_data)
-    if r.status_code != 201:
-        print("Failed to create PR")
-        return
-    
-    print(f"Created PR: {r.json()['html_url']}")
-
-def is_duplicate(new_incident, existing_incidents):
-    """Check if an incident is already recorded using GPT-4"""
-    # First check exact URL matches
-    for existing in existing_incidents:
-        existing_urls = {source['url'] for source in existing['sources']}
-        new_urls = {source['url'] for source in new_incident['sources']}
-        if existing_urls & new_urls:  # If there's any overlap in URLs
-            return True
-
-    # For incidents on the same date, use GPT-4 to check if they're the same
+def pull_request_title(new_incidents, updated_incidents):
+    """Summarise the changes of a PR, e.g. 'Add 2 new incidents, add sources to 1 incident'"""
+    parts = []
+    if new_incidents:
+        parts.append(f"add {len(new_incidents)} new incidents")
+    if updated_incidents:
+        parts.append(f"add sources to {len(updated_incidents)} incidents")
+    return ', '.join(parts).capitalize()
+
+def merge_sources(existing, incident):
+    """Add the sources of a duplicate incident to the recorded one, returning whether any were new"""
+    existing_urls = {source['url'] for source in existing['sources']}
+    added = [
+        s for s in incident['sources']
+        if s['url'] not in existing_urls
+    ]
+    existing['sources'].extend(added)
+    return bool(added)
+
+def serialize_for_comparison(incidents):
+    """Render incidents as the indexed JSON list used in the duplicate prompt"""
+    return json.dumps([{
+        'index': i,
+        'date': inc['date'],
+        'location': inc['location'],
+        'description': inc['description'],
+        'type': inc['type']
+    } for i, inc in enumerate(incidents)], indent=2, ensure_ascii=False)
+
+def parse_duplicate_reply(content):
+    """Decode the results list of a batch_deduplicate reply"""
+    results = json.loads(content).get('results')
+    if not isinstance(results, list):
+        raise ValueError(f"Reply has no results list: {content[:200]}")
+    return results
+
+def batch_deduplicate(new_incidents, url_to_incident, date_index):
+    """Split new incidents into those not recorded yet and the recorded ones that gained sources
+
+    Uses embeddings and at most one GPT-4 call. Duplicates are merged into
+    the recorded incidents in place."""
+    # First drop exact URL matches
+    candidates = [
+        incident for incident in new_incidents
+        if not any(source['url'] in url_to_incident for source in incident['sources'])
+    ]
+
+    # Only incidents on the same date can be the same event
+    to_compare = [incident for incident in candidates if incident['date'] in date_index]
+    if not to_compare:
+        return candidates, []
+
+    compare_dates = {incident['date'] for incident in to_compare}
     same_date_incidents = [
-        incident for incident in existing_incidents 
-        if incident['date'] == new_incident['date']
+        incident
+        for date in sorted(compare_dates)
+        for incident in date_index[date]
     ]
-    
-    if same_date_incidents:
-        prompt = f"""Compare these incidents and determine if they are the same event reported differently.
+
+    # Embedding similarity settles the clear cases without GPT-4
+    vectors = np.array(embed(client, [
+        f"{incident['description']} {incident['location']}"
+        for incident in to_compare + same_date_incidents
+    ]))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarity = vectors[:len(to_compare)] @ vectors[len(to_compare):].T
+    same_date = np.array([
+        [incident['date'] == existing['date'] for existing in same_date_incidents]
+        for incident in to_compare
+    ])
+    similarity = np.where(same_date, similarity, -1.0)
+
+    duplicates = set()
+    updated = {}
+    ambiguous = []
+    for i, incident in enumerate(to_compare):
+        best = int(similarity[i].argmax())
+        if similarity[i, best] > DUPLICATE_SIMILARITY:
+            existing = same_date_incidents[best]
+            if merge_sources(existing, incident):
+                updated[id(existing)] = existing
+            duplicates.add(id(incident))
+        elif similarity[i, best] >= DISTINCT_SIMILARITY:
+            ambiguous.append(incident)
+
+    if ambiguous:
+        # Feeds complete in arbitrary order; a canonical order keeps the
+        # prompt identical between runs so the LLM cache can answer it
+        ambiguous.sort(key=lambda incident: (
+            incident['date'], incident['location'], incident['description']
+        ))
+        ambiguous_dates = {incident['date'] for incident in ambiguous}
+        ambiguous_existing = [
+            incident for incident in same_date_incidents
+            if incident['date'] in ambiguous_dates
+        ]
+
+        prompt = f"""Compare each new incident with the existing incidents and determine if it is the same event reported differently.
+        Only incidents on the same date can be the same event.
         Consider location, type of attack, and description details.
-        Return only "true" if they are the same incident, or "false" if different.
-
-        Incident 1:
-        Location: {new_incident['location']}
-        Description: {new_incident['description']}
-        Type: {new_incident['type']}
-
-        Compare with each:
-        {json.dumps([{
-            'location': inc['location'],
-            'description': inc['description'],
-            'type': inc['type']
-        } for inc in same_date_incidents], indent=2, ensure_ascii=False)}
+        Return a JSON object of the form {{"results": [{{"index": <index of the new incident>, "duplicate_of": <index of the existing incident or null>}}]}}
+        with one entry per new incident.
+
+        New incidents:
+        {serialize_for_comparison(ambiguous)}
+
+        Existing incidents:
+        {serialize_for_comparison(ambiguous_existing)}
         """
 
-        response = client.chat.completions.create(
+        results = chat_completion(
+            client,
+            parse=parse_duplicate_reply,
             model="gpt-4-turbo-preview",
             messages=[{
-                "role": "user", 
+                "role": "user",
                 "content": prompt
             }],
-            temperature=0
+            temperature=0,
+            response_format={"type": "json_object"}
         )
 
-        is_same = response.choices[0].message.content.strip().lower() == "true"
-        
-        if is_same:
-            # Merge sources if it's the same incident
-            for existing in same_date_incidents:
-                existing_urls = {source['url'] for source in existing['sources']}
-                existing['sources'].extend([
-                    s for s in new_incident['sources'] 
-                    if s['url'] not in existing_urls
-                ])
-            return True
-
-    return False
+        duplicate_of = {
+            item.get('index'): item.get('duplicate_of')
+            for item in results
+            if isinstance(item, dict)
+        }
+
+        for i, incident in enumerate(ambiguous):
+            match = duplicate_of.get(i)
+            # bool is an int subclass; true/false must not pass as an index
+            if type(match) is not int or not 0 <= match < len(ambiguous_existing):
+                continue
+            existing = ambiguous_existing[match]
+            if existing['date'] != incident['date']:
+                continue
+
+            if merge_sources(existing, incident):
+                updated[id(existing)] = existing
+            duplicates.add(id(incident))
+
+    return (
+        [incident for incident in candidates if id(incident) not in duplicates],
+        list(updated.values())
+    )
 
 def debug_feed(feed_url):
     """Debug RSS feed access"""
     print(f"\nTesting feed: {feed_url}")
     try:
-        response = requests.get(
+        response = session.get(
             feed_url,
             headers={
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
@@ -352,66 +605,168 @@ def main():
         return
         
     current_data = load_current_incidents()
+    feed_cache = load_feed_cache()
+    llm_cache.prune()
     new_incidents = []
+    updated_incidents = []
     articles_checked = 0
     keywords_matched = 0
     
     print("\nCurrent incidents in database:", len(current_data['incidents']))
+
+    # Articles already recorded, or already queued in this run (the same
+    # story often shows up in more than one feed), never reach the LLM
+    url_to_incident, date_index = build_incident_indexes(current_data['incidents'])
+    seen_urls = set(url_to_incident)
     
-    for source in SOURCES:
-        print(f"\nProcessing feed: {source['feed']}")
-        try:
-            response = requests.get(source['feed'])
-            response.encoding = 'utf-8'
-            feed = feedparser.parse(response.text)
-            
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool, \
+            ThreadPoolExecutor(max_workers=LLM_WORKERS) as llm_pool:
+        # Start article downloads as soon as their feed arrives instead of
+        # waiting for the slowest feed
+        feed_futures = {
+            pool.submit(fetch_feed, source, feed_cache.get(source['feed'], {})): source
+            for source in SOURCES
+        }
+        article_futures = {}
+        # Cache updates are held back per feed and dropped if any of its
+        # matched articles fails, so the next run fetches it again
+        feed_updates = {}
+        failed_entries = defaultdict(list)
+        for future in as_completed(feed_futures):
+            source = feed_futures[future]
+            feed = future.result()
+            print(f"\nProcessing feed: {source['feed']}")
+            if feed is None:
+                continue
+
+            if feed.status == 304:
+                print("Feed not modified since last run")
+                continue
+
             if feed.bozo:
                 print(f"Error parsing feed: {feed.bozo_exception}")
                 continue
-                
+
             print(f"Found {len(feed.entries)} entries")
-            
-            for entry in feed.entries:
-                articles_checked += 1
-                if any(keyword in entry.title.lower() or 
-                      keyword in getattr(entry, 'description', '').lower()
-                      for keyword in source['keywords']):
-                    
-                    keywords_matched += 1
-                    print(f"\nPotential incident found in: {entry.title}")
-                    print(f"URL: {entry.link}")
-                    
-                    article_text = extract_text_from_article(entry.link)
-                    if not article_text:
-                        continue
-                    
-                    try:
-                        incident = parse_with_llm(article_text, entry.link, source['name'])
-                        if incident and not is_duplicate(incident, current_data['incidents']):
-                            print("✓ New verified incident found!")
-                            print(f"Location: {incident['location']}")
-                            print(f"Date: {incident['date']}")
-                            print(f"Type: {incident['type']}")
-                            new_incidents.append(incident)
-                    except Exception as e:
-                        print(f"Error processing article: {str(e)}")
+
+            try:
+                # Entries published before the newest one seen last run have
+                # already been checked
+                last_seen = feed_cache.get(source['feed'], {}).get('last_seen', 0)
+                newest = last_seen
+
+                for entry in feed.entries:
+                    published = entry.get('published_parsed') or entry.get('updated_parsed')
+                    if published:
+                        published = calendar.timegm(published)
+                        newest = max(newest, published)
+                        if published <= last_seen:
+                            continue
+
+                    articles_checked += 1
+                    title = entry.get('title', '')
+                    link = entry.get('link')
+                    if not link:
                         continue
-                        
-        except Exception as e:
-            print(f"Error processing feed: {str(e)}")
+
+                    # Newline keeps multi-word keywords from matching across fields
+                    text = f"{title}\n{entry.get('description', '')}".lower()
+                    if next(KEYWORD_AUTOMATON.iter(text), None) is not None:
+                        keywords_matched += 1
+                        if link in seen_urls:
+                            continue
+                        seen_urls.add(link)
+
+                        print(f"\nPotential incident found in: {title}")
+                        print(f"URL: {link}")
+                        article_futures[pool.submit(extract_text_from_article, link)] = (
+                            link, source, published
+                        )
+
+                feed_updates[source['feed']] = {
+                    'etag': feed.etag,
+                    'modified': feed.modified,
+                    'last_seen': newest
+                }
+            except Exception as e:
+                print(f"Error processing feed: {str(e)}")
+                continue
+
+        # Hand each article to the LLM as soon as its download finishes
+        llm_futures = []
+        for future in as_completed(article_futures):
+            link, source, published = article_futures[future]
+            try:
+                article_text = future.result()
+            except Exception as e:
+                print(f"Error extracting text from {link}: {str(e)}")
+                failed_entries[source['feed']].append(published)
+                continue
+            if not article_text:
+                continue
+
+            llm_futures.append((
+                source,
+                published,
+                llm_pool.submit(parse_with_llm, article_text, link, source['name'])
+            ))
+
+        parsed_incidents = []
+        for source, published, future in llm_futures:
+            try:
+                incident = future.result()
+                if incident:
+                    parsed_incidents.append(incident)
+            except Exception as e:
+                print(f"Error processing article: {str(e)}")
+                failed_entries[source['feed']].append(published)
+                continue
+
+    for feed_url, update in feed_updates.items():
+        if feed_url not in failed_entries:
+            feed_cache[feed_url] = update
             continue
+
+        # Keep the old validators so the feed is downloaded in full again,
+        # and only move last_seen up to just before the oldest failed entry
+        failed = failed_entries[feed_url]
+        if None not in failed:
+            feed_cache[feed_url] = {
+                **feed_cache.get(feed_url, {}),
+                'last_seen': min(failed) - 1
+            }
+
+    # No error handling here on purpose: reporting a failed check as "no new
+    # incidents" would save the feed cache and lose them for good
+    if parsed_incidents:
+        new_incidents, updated_incidents = batch_deduplicate(
+            parsed_incidents, url_to_incident, date_index
+        )
+
+    for incident in new_incidents:
+        print("✓ New verified incident found!")
+        print(f"Location: {incident['location']}")
+        print(f"Date: {incident['date']}")
+        print(f"Type: {incident['type']}")
     
     print("\n=== News Monitor Summary ===")
     print(f"Articles checked: {articles_checked}")
     print(f"Keyword matches: {keywords_matched}")
     print(f"New incidents found: {len(new_incidents)}")
+    print(f"Incidents with new sources: {len(updated_incidents)}")
     
-    if new_incidents:
+    # The feed cache is only written once the incidents and sources it covers
+    # are safely in a PR; otherwise the next run would skip them
+    if new_incidents or updated_incidents:
         current_data['incidents'].extend(new_incidents)
         current_data['lastUpdated'] = datetime.utcnow().isoformat() + 'Z'
-        create_pull_request(current_data)
-        print("\nCreated pull request with new incidents")
+        if create_pull_request(current_data, new_incidents, updated_incidents):
+            save_feed_cache(feed_cache)
+            print("\nCreated pull request with new incidents and sources")
+        else:
+            print("\nFailed to create pull request, feeds will be checked again next run")
     else:
+        save_feed_cache(feed_cache)
         print("\nNo new incidents to add")
     
     print("==========================")
@@ -0,0 +1,136 @@
+import contextlib
+import json
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+import llm_cache
+import monitor_news
+from monitor_news import batch_deduplicate, build_incident_indexes
+
+def incident(date, location, description, url):
+    return {
+        'date': date,
+        'location': location,
+        'description': description,
+        'type': 'physical_attack',
+        'status': 'verified',
+        'sources': [{'url': url, 'name': 'test'}]
+    }
+
+@contextlib.contextmanager
+def stub_llm(vectors, results=None):
+    """Replace embeddings and the GPT-4 call; yields the list of prompts sent"""
+    prompts = []
+
+    def embed(client, texts):
+        return [vectors[text] for text in texts]
+
+    def chat_completion(client, parse=lambda content: content, **request):
+        prompts.append(request['messages'][0]['content'])
+        return parse(json.dumps({"results": results or []}))
+
+    original = monitor_news.embed, monitor_news.chat_completion
+    monitor_news.embed = embed
+    monitor_news.chat_completion = chat_completion
+    try:
+        yield prompts
+    finally:
+        monitor_news.embed, monitor_news.chat_completion = original
+
+def existing_incidents():
+    return [
+        incident('2024-01-05', 'Hauptbahnhof', 'Angriff A', 'https://example.org/a'),
+        incident('2024-01-05', 'Neustadt', 'Angriff B', 'https://example.org/b'),
+        incident('2024-01-04', 'Sudenburg', 'Angriff C', 'https://example.org/c'),
+    ]
+
+def test_url_match_is_dropped_without_llm():
+    existing = existing_incidents()
+    with stub_llm({}) as prompts:
+        new = incident('2024-02-01', 'Anderswo', 'Neu', 'https://example.org/a')
+
+        assert batch_deduplicate([new], *build_incident_indexes(existing)) == ([], [])
+        assert prompts == []
+
+def test_similarity_bands_skip_llm():
+    existing = existing_incidents()
+    with stub_llm({
+        'Angriff A Hauptbahnhof': [1, 0, 0],
+        'Angriff B Neustadt': [0, 1, 0],
+        'Angriff B2 Neustadt': [0, 0.99, 0.1],
+        'Anderes Ereignis Olvenstedt': [0, 0, 1],
+    }) as prompts:
+        duplicate = incident('2024-01-05', 'Neustadt', 'Angriff B2', 'https://example.org/b2')
+        distinct = incident('2024-01-05', 'Olvenstedt', 'Anderes Ereignis', 'https://example.org/d')
+
+        result, updated = batch_deduplicate([duplicate, distinct], *build_incident_indexes(existing))
+
+        assert result == [distinct]
+        assert updated == [existing[1]]
+        assert prompts == []
+        assert [s['url'] for s in existing[1]['sources']] == [
+            'https://example.org/b', 'https://example.org/b2'
+        ]
+
+def test_llm_indices_map_to_same_date_incidents():
+    existing = existing_incidents()
+    # Both candidates sit in the ambiguous band against the two 2024-01-05 incidents
+    with stub_llm({
+        'Angriff A Hauptbahnhof': [1, 0, 0],
+        'Angriff B Neustadt': [0, 1, 0],
+        'Vorfall X Neustadt': [0.6, 0.7, 0.4],
+        'Vorfall Y Hauptbahnhof': [0.7, 0.6, 0.4],
+    }, results=[
+        # Candidates are sorted by date, location and description in the prompt
+        {"index": 0, "duplicate_of": None},
+        {"index": 1, "duplicate_of": 1},
+    ]) as prompts:
+        first = incident('2024-01-05', 'Neustadt', 'Vorfall X', 'https://example.org/x')
+        second = incident('2024-01-05', 'Hauptbahnhof', 'Vorfall Y', 'https://example.org/y')
+
+        result, updated = batch_deduplicate([first, second], *build_incident_indexes(existing))
+
+        assert len(prompts) == 1
+        assert result == [second]
+        assert updated == [existing[1]]
+        assert existing[0]['sources'] == [{'url': 'https://example.org/a', 'name': 'test'}]
+        assert [s['url'] for s in existing[1]['sources']] == [
+            'https://example.org/b', 'https://example.org/x'
+        ]
+
+def test_invalid_llm_matches_are_ignored():
+    existing = existing_incidents()
+    with stub_llm({
+        'Angriff A Hauptbahnhof': [1, 0, 0],
+        'Angriff B Neustadt': [0, 1, 0],
+        'Vorfall X Neustadt': [0.6, 0.7, 0.4],
+        'Vorfall Y Hauptbahnhof': [0.7, 0.6, 0.4],
+    }, results=[
+        "malformed",
+        {"index": 0, "duplicate_of": True},
+        {"index": 1, "duplicate_of": 5},
+    ]):
+        first = incident('2024-01-05', 'Neustadt', 'Vorfall X', 'https://example.org/x')
+        second = incident('2024-01-05', 'Hauptbahnhof', 'Vorfall Y', 'https://example.org/y')
+
+        result, updated = batch_deduplicate([first, second], *build_incident_indexes(existing))
+
+        assert result == [first, second]
+        assert updated == []
+        assert len(existing[1]['sources']) == 1
+
+def test_stubs_are_restored():
+    with stub_llm({}):
+        pass
+
+    assert monitor_news.embed is llm_cache.embed
+    assert monitor_news.chat_completion is llm_cache.chat_completion
+
+if __name__ == "__main__":
+    test_url_match_is_dropped_without_llm()
+    test_similarity_bands_skip_llm()
+    test_llm_indices_map_to_same_date_incidents()
+    test_invalid_llm_matches_are_ignored()
+    test_stubs_are_restored()
+    print("All deduplication tests passed")